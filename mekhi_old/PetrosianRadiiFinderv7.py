@@ -5,18 +5,29 @@ Current Version: 1.0
 
 """
 import os
+import sys
 import time
+import functools
+from dataclasses import dataclass, field
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
 import numpy as np
+import pandas as pd
+import matplotlib
+if '--display' not in sys.argv:
+    matplotlib.use('Agg') # Headless batch run, no GUI backend is loaded; pass --display to show plots
 import matplotlib.pyplot as plt
+from matplotlib.collections import LineCollection
 
-from scipy.integrate import simpson
+from scipy.integrate import cumulative_simpson
+from scipy.spatial import cKDTree
+from scipy.ndimage import gaussian_filter
 
 from astroquery.mast import Observations
 
 import astropy.units as u
 from astropy.io import fits
 from astropy.visualization import ZScaleInterval
-from astropy.convolution import convolve
 from astropy.visualization import simple_norm
 from astropy.coordinates import SkyCoord
 from astropy.wcs import WCS
@@ -34,21 +45,21 @@ SYS_TIME = str(int(time.time())) # System Time, for purposes of naming files uni
 PIX_SCALE = 0.031 # arcsec/pix, from https://jwst-docs.stsci.edu/jwst-near-infrared-camera
 SPEED_OF_LIGHT = 3e5 # km/s
 H0 = 73.8 #km/s/Mpc
-DISPLAY_MODE = False
+KPC_PER_PIX_PER_Z = (SPEED_OF_LIGHT / H0) * PIX_SCALE * (np.pi/(180*3600)) * 1000 # kpc/pix per unit redshift (Hubble law)
+DISPLAY_MODE = '--display' in sys.argv
 
+@dataclass(slots=True, eq=False) # eq=False keeps identity comparison/hashing (fields hold numpy arrays)
 class petrosianObject():
-    def __init__(self, ID='None', z=None, pos=(0, 0), SB=[], SBerr=[], iso_radii=[], iso_eps=[], isolist=None, aper=None, petroR=0.00):
-        self.ID = ID
-        self.z = z
-        self.pos = pos
-        self.SB = SB
-        self.SBerr = SBerr
-        self.iso_radii = iso_radii
-        self.iso_eps = iso_eps
-        self.isolist = isolist
-        self.aper = aper
-        self.petroR = petroR
-        return
+    ID: int | str = 'None'
+    z: float | None = None
+    pos: tuple = (0, 0)
+    SB: list = field(default_factory=list)
+    SBerr: list = field(default_factory=list)
+    iso_radii: list = field(default_factory=list)
+    iso_eps: list = field(default_factory=list)
+    isolist: object = None
+    aper: object = None
+    petroR: float = 0.00
 
     def __str__(self):
         return("Petrosian object, " + str(self.ID) + " | Center Position: " + str(self.pos) + ", " +
@@ -71,7 +82,27 @@ class petrosianObject():
         return
 
     def toKpc(self):
-        return ((SPEED_OF_LIGHT*self.z) / H0) * self.petroR * PIX_SCALE * (np.pi/(180*3600)) * 1000
+        return self.z * self.petroR * KPC_PER_PIX_PER_Z
+
+def to_soa(objs):
+    """
+    Collect the scalar fields of a list of petrosian objects into parallel arrays, for whole-catalog math
+    ---
+    Input:  objs, list; petrosianObjects
+    Output: dict; 'ID', 'z' & 'petroR' as numpy.array of length N, 'pos' as numpy.array of shape (N, 2)
+    """
+    return {'ID': np.array([obj.ID for obj in objs]),
+            'z': np.array([obj.z for obj in objs], dtype=float),
+            'pos': np.array([obj.pos for obj in objs], dtype=float).reshape(-1, 2),
+            'petroR': np.array([obj.petroR for obj in objs], dtype=float)}
+
+def show_plot():
+    # Only open plot windows in display mode, otherwise just free the figure
+    if DISPLAY_MODE:
+        plt.show()
+    else:
+        plt.close()
+    return
 
 def quick_plot(data=None, title="Default" , cmap='magma', interpolation='antialiased', show=True):
     z1, z2 = ZScaleInterval().get_limits(values=data)
@@ -81,11 +112,16 @@ def quick_plot(data=None, title="Default" , cmap='magma', interpolation='antiali
         plt.imshow(data, origin="lower", cmap=cmap, interpolation=interpolation)
     plt.title(title)
     if show:
-        plt.show()
+        show_plot()
     return
 
 def universalToKpc(z, d):
-    return ((SPEED_OF_LIGHT*z) / H0) * d * PIX_SCALE * (np.pi/(180*3600)) * 1000
+    return z * d * KPC_PER_PIX_PER_Z
+
+@functools.lru_cache(maxsize=8)
+def get_kernel(fwhm, size):
+    # Kernel only depends on its constant parameters, so build it once and reuse it
+    return make_2dgaussian_kernel(fwhm, size=size)
 
 def image_segmintation(data, threshold=0.5, display=True):
     convolved_FWHM = 3.0
@@ -96,10 +132,18 @@ def image_segmintation(data, threshold=0.5, display=True):
     quick_plot(data=data, title="Raw data")
 
     print("Convolving data with a 2D kernal...")
-    kernel = make_2dgaussian_kernel(convolved_FWHM, size=convolved_size)
-    convolved_data = convolve(data, kernel)
+    # A 2D gaussian is separable, so smooth with two 1D passes instead of a full 2D convolution. Truncating at
+    # size//2 pixels gives the same footprint as the (size x size) kernel; pixels past the edge are zeros and NaNs
+    # are ignored by renormalizing with the weights of the valid pixels, as astropy's convolve() does.
+    sigma = convolved_FWHM / (2 * np.sqrt(2 * np.log(2)))
+    truncate = (convolved_size // 2) / sigma
+    nanMask = np.isnan(data)
+    convolved_data = gaussian_filter(np.where(nanMask, 0, data), sigma=sigma, truncate=truncate, mode='constant', cval=0.0)
+    if nanMask.any():
+        weights = gaussian_filter((~nanMask).astype(np.float32), sigma=sigma, truncate=truncate, mode='constant', cval=1.0)
+        convolved_data /= weights
     if display:
-        quick_plot(data=kernel, title="Kernal")
+        quick_plot(data=get_kernel(convolved_FWHM, convolved_size), title="Kernal")
 
     print("Detecting sources in convolved data...")
     segment_map = detect_sources(convolved_data, threshold, npixels=segment_npixels)
@@ -144,7 +188,7 @@ def image_segmintation(data, threshold=0.5, display=True):
     # norm = simple_norm(data, 'sqrt')
     quick_plot(segment_map, title='kron apertures', cmap=segment_map.cmap, show=False)
     cat.plot_kron_apertures(color='green', lw=1.5)
-    plt.show()
+    show_plot()
 
     return sources_x, sources_y, sources_eps, apers
 
@@ -164,8 +208,6 @@ def isophote_fit_image_aper(dat, aper, eps=0.01, perExtra=150):
     Notes:  Algorithum used is from Jedrzejewski (1987; MNRAS 226, 747)
             https://ui.adsabs.harvard.edu/abs/1987MNRAS.226..747J/abstract
     """
-    z1, z2 = ZScaleInterval().get_limits(values=dat)  # MJy/sr
-
     cen = [aper.positions[0], aper.positions[1]] # Grab updated centers
 
     # plt.imshow(dat, origin='lower', vmin=z1, vmax=z2) # Plot ALL data from fits, bounded
@@ -192,7 +234,33 @@ def isophote_fit_image_aper(dat, aper, eps=0.01, perExtra=150):
     # if display:
     #     plt.show()
 
-    return isolist.sma, isolist.intens, isolist.int_err, isolist.to_table()['ellipticity'], isolist
+    return isolist.sma, isolist.intens, isolist.int_err, isolist.eps, isolist
+
+def isophote_rings(isolist, nRings=15):
+    """
+    Sample the isophotes closest to nRings evenly spaced sma values out to the largest isophote, for display
+    ---
+    Input:  isolist, photutils.isophote.IsophoteList; fitted isophotes, sorted by sma
+            nRings, int; number of rings, -1 for every isophote
+    Output: list; (N, 2) numpy.array of x-y positions for each ring
+    Notes:  Rings that land on the same isophote share it, so each isophote is only sampled once
+    """
+    smaArr = isolist.sma
+    if nRings == -1:  # nRings=-1 plots all the rings
+        nRings = len(smaArr)
+    if nRings == 0 or len(smaArr) == 0:  # Makes sure that there is data from the isophote fit
+        return []
+
+    rMax = smaArr[-1]  # Largest radius
+    rings = np.arange(0, rMax, rMax / nRings)
+    rings += rMax / nRings
+    # Displayed isophotes are just the closest isophotes to a certain desired sma, but there are more
+    # isophotes between the ones displayed. Same choice as isolist.get_closest(), for all rings at once.
+    idxs = np.searchsorted(smaArr, rings)
+    lower = np.clip(idxs - 1, 0, len(smaArr) - 1)
+    upper = np.clip(idxs, 0, len(smaArr) - 1)
+    idxs = np.where(np.abs(rings - smaArr[lower]) <= np.abs(smaArr[upper] - rings), lower, upper)
+    return [np.column_stack(isolist[j].sampled_coordinates()) for j in np.unique(idxs)]
 
 def plot_sb_profile(ID='', r=None, SB=None, err=None, sigma=10, r_forth=False, units=False, save=False):
     """
@@ -220,7 +288,7 @@ def plot_sb_profile(ID='', r=None, SB=None, err=None, sigma=10, r_forth=False, u
     plt.ylabel("Intensity, I [MJy/sr]")
     if save:
         plt.savefig(r"results\SBprofile_" + str(int(SYS_TIME)) + ".png")
-    plt.show()
+    show_plot()
 
     return None
 
@@ -228,46 +296,136 @@ def petrosian_radius(radius=None, SB=None, eps=None, sens=0.01):
     adda = 0.2  # Target constant
     petro_r = 0 # Initalizing petrosian value
 
-    for i in range(2, len(radius)):
-        localSB = SB[i]
-        a = radius[:i]
-        eps_i = eps[:i]
-        SB_i = SB[:i]
-
-        b = a[-1] - (eps_i[-1] * a[-1])  # Semi-minor Axis
-        SBtoR = simpson(y=SB_i, x=a) * 2 * np.pi
-        area = np.pi * a[-1] * b
-
-        integratedSB = SBtoR / area
-
-        if abs(integratedSB - (adda*localSB)) < sens:
-            petro_r = radius[i]
-            break
+    radius = np.asarray(radius, dtype=float)
+    SB = np.asarray(SB, dtype=float)
+    eps = np.asarray(eps, dtype=float)
+    if len(radius) < 3:
+        return petro_r
+
+    # Integrate once out to every isophote instead of re-integrating each prefix
+    SBtoR = cumulative_simpson(y=SB, x=radius, initial=0) * 2 * np.pi
+    b = radius - (eps * radius)  # Semi-minor Axis
+    area = np.pi * radius * b
+
+    # SB integrated out to isophote i-1, compared against the local SB at isophote i
+    integratedSB = SBtoR[1:-1] / area[1:-1]
+    localSB = SB[2:]
+
+    f = integratedSB - (adda*localSB)
+    r = radius[2:]
+
+    # The petrosian radius is where f changes sign; an isophote within sens of it also counts, whichever comes first
+    near = np.flatnonzero(np.abs(f) < sens)
+    crossed = np.flatnonzero((np.sign(f[:-1]) != np.sign(f[1:])) & np.isfinite(f[:-1]) & np.isfinite(f[1:]))
+    if len(near) > 0 and (len(crossed) == 0 or near[0] <= crossed[0]):
+        petro_r = r[near[0]]
+    elif len(crossed) > 0:
+        k = crossed[0] # Interpolate between the two isophotes bracketing the crossing
+        petro_r = r[k] - f[k] * (r[k+1] - r[k]) / (f[k+1] - f[k])
     return petro_r
 
 def world_to_pix(data, crd, targetPath):
     # Plot/Organize coords
-    allCoordPix = []
-    targetIDs = []
-
-
     targets = np.genfromtxt(targetPath, delimiter=',', skip_header=1, dtype=float)
     targets = targets[:, :4]
     targetIDs = targets[:, 0]
     targetZs = targets[:, 3]
 
+    # Convert every target in one call rather than building a SkyCoord per row
+    coordsWorld = SkyCoord(ra=targets[:, 1], dec=targets[:, 2], unit="deg")
+    xPix, yPix = coordsWorld.to_pixel(crd, origin=0)
+    allCoordPix = np.column_stack([xPix, yPix])
+
     plt.imshow(data, origin="lower", cmap='magma', vmin=0, vmax=0.5)
     plt.title("Targets from Gus List over FITS-C1009-T008-NIRCAM-F090W")
-    for t in targets:
-        RA = t[1]
-        DEC = t[2]
-        coordWorld = SkyCoord(ra=RA, dec=DEC, unit="deg")
-        coordPix = coordWorld.to_pixel(crd, 0)
-        allCoordPix.append(np.array([coordPix[0], coordPix[1]]))
-        plt.plot(coordPix[0], coordPix[1], marker='+', color='g')
-    plt.show()
+    plt.scatter(xPix, yPix, marker='+', color='g')
+    show_plot()
     return allCoordPix, targetIDs, targetZs
 
+WORKER_SHM = None  # Shared memory block holding the FITS data, attached once per worker process
+WORKER_DATA = None # FITS data as seen by a worker process, backed by WORKER_SHM
+
+def init_worker(shmName, shape, dtype):
+    global WORKER_SHM, WORKER_DATA
+    WORKER_SHM = shared_memory.SharedMemory(name=shmName)
+    WORKER_DATA = np.ndarray(shape, dtype=dtype, buffer=WORKER_SHM.buf)
+    return
+
+def fit_petrosian(obj, data=None, tryLim=50, extentOfDetect=100, petroSens=0.1, tryIsoIncrease=18, tryEpsIncrease=0.0195):
+    """
+    Fit isophotes to a single object and search for its petrosian radius, retrying with a larger ellipticity and
+    then a larger isophote range when a fit fails
+    ---
+    Input:  obj, petrosianObject; object with its aperture set
+            data, numpy.array; intensity values of the fits file, defaults to the worker's shared memory copy
+    Output: obj, petrosianObject; the same object with its isophotes and petrosian radius (0 if none was found)
+    """
+    if data is None:
+        data = WORKER_DATA
+
+    # Isophote Fit
+    print("[", obj.ID, "] Fiting isophotes...")
+    localEps = 0.01
+    attemptIso = 0
+    while attemptIso <= tryLim:
+        tempRadii, tempSB, tempSBerr, tempEps, tempIsolist = isophote_fit_image_aper(dat=data,
+                                                                                     aper=obj.aper,
+                                                                                     eps=localEps,
+                                                                                     perExtra=extentOfDetect)
+        if len(tempRadii) > 0 or attemptIso == tryLim:
+            obj.iso_radii = tempRadii
+            obj.SB = tempSB
+            obj.SBerr = tempSBerr
+            obj.iso_eps = tempEps
+            obj.isolist = tempIsolist
+            break  # Leave while loop (petrosian found)
+        else:
+            localEps += tryEpsIncrease
+            print("[", obj.ID, "] Fit Failed, altering ellipticity ",
+                  tryEpsIncrease, " (New: ", localEps, ")")
+            attemptIso += 1
+    if len(tempRadii) == 0:
+        print("![", obj.ID, "] FATAL -- NO FIT DETERMINED!")
+        return detach_image(obj)
+
+    # PETROSIAN RADIUS
+    print("[", obj.ID, "] Calculating petrosian radii...")
+    attemptPetro = 0
+    localExtentOfDetect = extentOfDetect
+    while attemptPetro <= tryLim:
+        petro_r = petrosian_radius(radius=obj.iso_radii, SB=obj.SB,
+                                   eps=obj.iso_eps, sens=petroSens)
+        if petro_r > 0:
+            obj.petroR = petro_r
+            break
+        else:
+            localExtentOfDetect += tryIsoIncrease
+            print("[", obj.ID, "] No petrosian found, extending range by", tryIsoIncrease,
+                  "% (Now: ", localExtentOfDetect, "%)")
+            tempRadii, tempSB, tempSBerr, tempEps, tempIsolist = isophote_fit_image_aper(dat=data,
+                                                                                         aper=obj.aper,
+                                                                                         eps=localEps,
+                                                                                         perExtra=localExtentOfDetect)
+            obj.iso_radii = tempRadii
+            obj.SB = tempSB
+            obj.SBerr = tempSBerr
+            obj.iso_eps = tempEps
+            obj.isolist = tempIsolist
+
+            attemptPetro += 1
+
+    if petro_r == 0:
+        print("![", obj.ID, "] FATAL -- NO PETROSIAN RADIUS DETERMINED!")
+    return detach_image(obj)
+
+def detach_image(obj):
+    # Every isophote sample holds a reference to the full image; drop it so only the fit is pickled back to the
+    # parent process. sampled_coordinates() only needs the sample's geometry and values.
+    if obj.isolist is not None:
+        for iso in obj.isolist:
+            iso.sample.image = None
+    return obj
+
 if __name__ == "__main__":
     mainPath = r'downloads\jw01181-c1009_t008_nircam_clear-f090w_i2d.fits'
     altPath=r'downloads/jw01181-c1009_t008_nircam_clear-f090w_i2d.fits'
@@ -291,6 +449,7 @@ if __name__ == "__main__":
         data = hdu.data
         hdr = hdu.header
         datacoords = WCS(hdr)
+    data = np.ascontiguousarray(data, dtype=np.float32) # float32 is plenty for detection & fitting, halves memory traffic
 
     # OPEN TARGET LIST
     #----------------------------------------------------------------------------------------------------------------
@@ -302,24 +461,27 @@ if __name__ == "__main__":
     #----------------------------------------------------------------------------------------------------------------
     print("Detecting sources (segmenting image)...")
     sources_x, sources_y, sources_eps, apers = image_segmintation(data, threshold=sourceSens, display=False)
-    positions = []
-    for i in range(len(sources_x)):
-        positions.append(np.array([sources_x[i], sources_y[i]]))
+    positions = np.column_stack([sources_x, sources_y])
 
     # DETERMINE SOURCE OVERLAP WITH TARGET LIST
     #----------------------------------------------------------------------------------------------------------------
-    overlappedPositions, overlappedEps, overlappedApers, overlappedIDs, overlappedZs = [], [], [], [], []
-    for i in range(len(targetsPix)):
-        for j in range(len(positions)):
-            rangex = abs(positions[j][0] - targetsPix[i][0])
-            rangey = abs(positions[j][1] - targetsPix[i][1])
-            if rangex < overlapSens and rangey < overlapSens:
-                overlappedPositions.append(np.array([positions[j][0], positions[j][1]]))
-                overlappedEps.append(sources_eps[j])
-                overlappedApers.append(apers[j])
-                overlappedIDs.append(targetIDs[i])
-                overlappedZs.append(targetZs[i])
-
+    # Chebyshev (p=inf) ball query over the +/- overlapSens box around each target. query_ball_point includes the
+    # boundary, so the radius is nudged just below overlapSens to keep the strict '<' of the box test. Sources and
+    # targets with NaN/inf coordinates can't be queried and never matched anyway, so they're left out and the
+    # matches are mapped back to their original indices.
+    finiteSources = np.flatnonzero(np.isfinite(positions).all(axis=1))
+    finiteTargets = np.flatnonzero(np.isfinite(targetsPix).all(axis=1))
+    tree = cKDTree(positions[finiteSources])
+    matches = tree.query_ball_point(targetsPix[finiteTargets], r=np.nextafter(overlapSens, 0), p=np.inf)
+    matches = [finiteSources[sorted(js)] for js in matches]
+    matchedTargets = np.array([i for i, js in zip(finiteTargets, matches) for j in js], dtype=int)
+    matchedSources = np.array([j for js in matches for j in js], dtype=int)
+
+    overlappedPositions = positions[matchedSources]
+    overlappedEps = np.asarray(sources_eps)[matchedSources]
+    overlappedApers = [apers[j] for j in matchedSources] # Apertures are photutils objects, so stay in a list
+    overlappedIDs = np.asarray(targetIDs, dtype=np.int64)[matchedTargets]
+    overlappedZs = np.asarray(targetZs)[matchedTargets]
 
     # MAKE PETRO OBJECTS
     #----------------------------------------------------------------------------------------------------------------
@@ -331,11 +493,11 @@ if __name__ == "__main__":
 
     # REMOVE DUPLICATES
     #----------------------------------------------------------------------------------------------------------------
-    seen = []
+    seen = set()
     seenObj = []
     for obj in petroObjs:
         if obj.ID not in seen:
-            seen.append(obj.ID)
+            seen.add(obj.ID)
             seenObj.append(obj)
     petroObjs = seenObj
 
@@ -344,80 +506,31 @@ if __name__ == "__main__":
     plt.figure(figsize=(10, 10))
     quick_plot(data, title='Overlap from Gus Targets & Source Detection \n N=' +
                            str(len(overlappedPositions) - (len(overlappedPositions) - len(seenObj))), show=False)
-    for t in targetsPix:
-        plt.plot(t[0], t[1], marker='+', color='g')
-    for obj in petroObjs:
-        plt.plot(obj.pos[0], obj.pos[1], marker='x', color='b')
+    plt.scatter(targetsPix[:, 0], targetsPix[:, 1], marker='+', color='g')
+    petroPos = to_soa(petroObjs)['pos']
+    plt.scatter(petroPos[:, 0], petroPos[:, 1], marker='x', color='b')
     # plt.xlim(-1000, 4500); plt.ylim(2500, 8250)
-    plt.show()
+    show_plot()
     print("Number Overlapped: ", len(overlappedPositions) - (len(overlappedPositions) - len(seenObj)))
     print("Number Doubled: ", len(overlappedPositions) - len(seenObj))
     print("Expected: ", len(targetsPix))
 
     # PROCESSING
     #----------------------------------------------------------------------------------------------------------------
-    fatalCount = 0
-    for i in range(len(petroObjs)):
-        print("[", i+1, '/', len(petroObjs), "]")
-        fatal = False
-        # Isophote Fit
-        print("[", petroObjs[i].ID, "] Fiting isophotes...")
-        localEps = 0.01
-        attemptIso = 0
-        while attemptIso <= tryLim:
-            tempRadii, tempSB, tempSBerr, tempEps, tempIsolist = isophote_fit_image_aper(dat=data,
-                                                                                         aper=petroObjs[i].aper,
-                                                                                         eps=localEps,
-                                                                                         perExtra=extentOfDetect)
-            if len(tempRadii) > 0 or attemptIso == tryLim:
-                petroObjs[i].iso_radii = tempRadii
-                petroObjs[i].SB = tempSB
-                petroObjs[i].SBerr = tempSBerr
-                petroObjs[i].iso_eps = tempEps
-                petroObjs[i].isolist = tempIsolist
-                break  # Leave while loop (petrosian found)
-            else:
-                localEps += tryEpsIncrease
-                print("[", petroObjs[i].ID, "] Fit Failed, altering ellipticity ",
-                      tryEpsIncrease, " (New: ", localEps, ")")
-                attemptIso += 1
-        if len(tempRadii) == 0:
-            print("![", petroObjs[i].ID, "] FATAL -- NO FIT DETERMINED!")
-            fatal = True
-            fatalCount += 1
-
-        if not fatal:
-            # PETROSIAN RADIUS
-            print("[", petroObjs[i].ID, "] Calculating petrosian radii...")
-            realPetroObjs = []
-            attemptPetro = 0
-            localExtentOfDetect = extentOfDetect
-            while attemptPetro <= tryLim:
-                petro_r = petrosian_radius(radius=petroObjs[i].iso_radii, SB=petroObjs[i].SB,
-                                           eps=petroObjs[i].iso_eps, sens=petroSens)
-                if petro_r > 0:
-                    petroObjs[i].petroR = petro_r
-                    realPetroObjs.append(petroObjs[i])
-                    break
-                else:
-                    localExtentOfDetect += tryIsoIncrease
-                    print("[", petroObjs[i].ID, "] No petrosian found, extending range by", tryIsoIncrease,
-                          "% (Now: ", localExtentOfDetect, "%)")
-                    tempRadii, tempSB, tempSBerr, tempEps, tempIsolist = isophote_fit_image_aper(dat=data,
-                                                                                                 aper=petroObjs[i].aper,
-                                                                                                 eps=localEps,
-                                                                                                 perExtra=localExtentOfDetect)
-                    petroObjs[i].iso_radii = tempRadii
-                    petroObjs[i].SB = tempSB
-                    petroObjs[i].SBerr = tempSBerr
-
-                    attemptPetro += 1
-
-            if petro_r == 0:
-                print("![", petroObjs[i].ID, "] FATAL -- NO PETROSIAN RADIUS DETERMINED!")
-                fatal = True
-                fatalCount += 1
-        print('\n')
+    # Each galaxy is fit independently, so fan the fits out over processes. The FITS data is placed in shared
+    # memory once so it isn't pickled to every worker.
+    shm = shared_memory.SharedMemory(create=True, size=data.nbytes)
+    try:
+        np.ndarray(data.shape, dtype=data.dtype, buffer=shm.buf)[:] = data
+        fitter = functools.partial(fit_petrosian, tryLim=tryLim, extentOfDetect=extentOfDetect, petroSens=petroSens,
+                                   tryIsoIncrease=tryIsoIncrease, tryEpsIncrease=tryEpsIncrease)
+        with ProcessPoolExecutor(max_workers=os.cpu_count(), initializer=init_worker,
+                                 initargs=(shm.name, data.shape, data.dtype)) as ex:
+            petroObjs = list(ex.map(fitter, petroObjs))
+    finally:
+        shm.close()
+        shm.unlink()
+    fatalCount = sum(1 for obj in petroObjs if obj.petroR == 0)
     print('Success Rate of Petrosian: ', (len(petroObjs) - fatalCount)/len(petroObjs)*100, '% [', (len(petroObjs) - fatalCount), '/', len(petroObjs), ']')
 
     # DISPLAY
@@ -426,73 +539,69 @@ if __name__ == "__main__":
     crop = 150
     nRings = 15
 
-    for obj in petroObjs:
-        current_petroR = round(obj.toKpc(), 2)
+    petroCat = to_soa(petroObjs)
+    petroKpc = universalToKpc(petroCat['z'], petroCat['petroR'])
+
+    z1, z2 = ZScaleInterval().get_limits(values=data)
+
+    # One figure is reused for every object; the image is the same each time, so it is drawn once and only the
+    # view, rings and profile change per object
+    fig = plt.figure(figsize=(12, 8))
+    ax1 = fig.add_subplot(223) # Raw Data
+    ax2 = fig.add_subplot(224) # Isophote Rings
+    ax3 = fig.add_subplot(211) # Surface Brightness plot
+    for ax in (ax1, ax2):
+        ax.imshow(data, origin="lower", cmap='magma', vmin=z1, vmax=z2)
+        ax.set_xlabel('[pixels]')
+        ax.set_ylabel('[pixels]')
+
+    for obj, objKpc in zip(petroObjs, petroKpc):
+        current_petroR = round(objKpc, 2)
 
-        z1, z2 = ZScaleInterval().get_limits(values=data)
-        fig = plt.figure(figsize=(12, 8))
         fig.suptitle('ID [' + str(obj.ID) + ']' + '\n' +
                      # 'Center: (' + str(round(obj.pos[0], 2)) + ', ' + str(round(obj.pos[1], 2)) + ') | ' +
                      'Petrosian Radius: ' + str(current_petroR) + ' [kpc] | ' +
                      'Redshift: ' + str(round(obj.z, 2)))
 
         # Raw Data
-        # Raw Data
-        # ax1 = plt.subplot(223)
-        # crop = 70
-        # ax1.imshow(data, origin="lower", cmap='magma', vmin=z1, vmax=z2)
-        # cenx, ceny = int(obj.pos[0]), int(obj.pos[1])
-        # ax1.set_xlim(cenx - crop, cenx + crop)
-        # ax1.set_ylim(ceny - crop, ceny + crop)
-        # ax1.set_xlabel('[pixels]')
-        # ax1.set_ylabel('[pixels]')
-        ax1 = plt.subplot(223)
         cenx, ceny = int(obj.pos[0]), int(obj.pos[1])
-        ax1.imshow(data, origin="lower", cmap='magma', vmin=z1, vmax=z2)
         ax1.set_xlim(cenx - crop, cenx + crop)
         ax1.set_ylim(ceny - crop, ceny + crop)
-        ax1.set_xlabel('[pixels]')
-        ax1.set_ylabel('[pixels]')
-
 
         # Isophote Rings
-        ax2 = plt.subplot(224)
-        ax2.imshow(data, origin="lower", cmap='magma', vmin=z1, vmax=z2)
-        if nRings == -1:  # nRings=-1 plots all the rings
-            nRings = len(obj.isolist.to_table()['sma'])
-        if nRings != 0 and len(obj.isolist.to_table()['sma']) > 0:  # Makes sure that there is data from the isophote fit
-            rMax = obj.isolist.to_table()['sma'][-1]  # Largest radius
-            rings = np.arange(0, rMax, rMax / nRings)
-            rings += rMax / nRings
-            for sma in rings:
-                iso = obj.isolist.get_closest(sma)  # Displayed isophotes are just the closest isophotes to a certain desired sma, but
-                                                    # there are more isophotes between the ones displayed.
-                ax2.plot(iso.sampled_coordinates()[0], iso.sampled_coordinates()[1], color='g', linewidth=1)
+        for ringArtist in list(ax2.collections): # Clear the previous object's rings
+            ringArtist.remove()
+        ringLines = isophote_rings(obj.isolist, nRings=nRings)
+        if len(ringLines) > 0:
+            ax2.add_collection(LineCollection(ringLines, colors='g', linewidths=1))
         ax2.set_xlim(cenx - crop, cenx + crop)
         ax2.set_ylim(ceny - crop, ceny + crop)
-        ax2.set_xlabel('[pixels]')
-        ax2.set_ylabel('[pixels]')
 
         # Surface Brightness plot
-        ax3 = plt.subplot(211)
+        ax3.clear()
         ax3.errorbar(universalToKpc(obj.z, obj.iso_radii), obj.SB, yerr=(obj.SBerr) * 10, fmt='o', ms=2)
         ax3.axvline(x=current_petroR, color='r', label='Petrosian Radius = '+str(current_petroR)+' [kpc]')
         ax3.set_xlabel('radius [kpc]')
         ax3.set_ylabel('Intensity [MJy/sr]')
         ax3.legend()
 
-        plt.savefig('images/' + fileDesc + '/' + str(SYS_TIME)  + '/' + str(obj.ID) + '_' + str(SYS_TIME) + '.png', dpi=300)
-        plt.show()
+        fig.savefig('images/' + fileDesc + '/' + str(SYS_TIME)  + '/' + str(obj.ID) + '_' + str(SYS_TIME) + '.png', dpi=150)
+        if DISPLAY_MODE:
+            plt.pause(0.001)
+    plt.close(fig)
 
     # WRITE RADII & ID TO FILE
     #----------------------------------------------------------------------------------------------------------------
     with (open('petrosians/'+str(fileDesc)+'_petrosians.csv', 'w') as f):
         print('Wrote to...', 'petrosians/'+str(fileDesc)+'_petrosians.csv')
         f.write('File: '+altPath+'\n')
-        f.write('ID,PETROSIANPIX,PETROSIANKPC,PIXCENTERX,PIXCENTERY,REDSHIFT\n')
-        for obj in petroObjs:
-            line = str(obj.ID) + ',' + str(obj.petroR) + ',' + str(obj.toKpc()) + ',' + str(obj.pos[0]) + ',' + str(obj.pos[1]) + ',' + str(obj.z) + '\n'
-            f.write(line)
+        petroTable = pd.DataFrame({'ID': petroCat['ID'],
+                                   'PETROSIANPIX': petroCat['petroR'],
+                                   'PETROSIANKPC': petroKpc,
+                                   'PIXCENTERX': petroCat['pos'][:, 0],
+                                   'PIXCENTERY': petroCat['pos'][:, 1],
+                                   'REDSHIFT': petroCat['z']})
+        petroTable.to_csv(f, index=False, lineterminator='\n')
 
 
 
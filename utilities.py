@@ -1,5 +1,4 @@
 import os
-import math
 import datetime
 import numpy as np
 from astropy.modeling.models import Gaussian2D
@@ -42,11 +41,7 @@ def blueshifter(z, wavelength):  # in microns!!!
 
 # Shifts a list of wavelengths based on a given value for z
 def listBlueshifter(z, wavelengths):  # in microns!!!
-    restList = []
-    for WL in wavelengths:
-        restWL = WL / (z + 1)
-        restList.append(restWL)
-    return restList
+    return np.asarray(wavelengths, dtype=np.float64) / (z + 1)
 
 # Avoids hidden folders/files when iterating through a directory
 def listdir_nohidden(path):
@@ -55,48 +50,37 @@ def listdir_nohidden(path):
             yield f
 
 # Rotates a point n radians about another point
+# point may also be a (2, N) array of x and y coordinates, e.g. iso.sampled_coordinates(), to rotate all at once
 def rotate(origin, point, angle):
     ox, oy = origin
-    px, py = point
+    px, py = np.asarray(point, dtype=np.float64)
+    cos, sin = np.cos(angle), np.sin(angle)
 
-    qx = ox + math.cos(angle) * (px - ox) - math.sin(angle) * (py - oy)
-    qy = oy + math.sin(angle) * (px - ox) + math.cos(angle) * (py - oy)
+    qx = ox + cos * (px - ox) - sin * (py - oy)
+    qy = oy + sin * (px - ox) + cos * (py - oy)
     return qx, qy
 
 def gusRotate(origin, point, angle):
     ox, oy = origin
-    px, py = point
-    hyp = math.sqrt((px - ox)**2 + (py - oy)**2)
+    px, py = np.asarray(point, dtype=np.float64)
+    hyp = np.hypot(px - ox, py - oy)
 
-    qx = ox - (hyp * math.cos(angle))
-    qy = oy - (hyp * math.sin(angle))
+    qx = ox - (hyp * np.cos(angle))
+    qy = oy - (hyp * np.sin(angle))
     return qx, qy
 
+# Crops an array symmetrically about a point, as far as the nearest edge allows on each axis (returns a view)
 def centerPoint(array, point):
     (x, y) = point
     (height, width) = array.shape
 
-    if (height - y) >= (height / 2):
-        # crop above and below y at (height - y - 1)
-        newArr = array[0:(2*y) - 1, :]
-    else:
-        # crop above and below y at (height - y)
-        newArr = array[y - (height - y):2*(y - (height - y)) - 1, :]
-
-    if (width - x) > (width / 2) or (width - x) == (width / 2):
-        # crop left and right of x at (width - x - 1)
-        newArr = newArr[:, 0:(2*x) - 1]
-    else:
-        # crop left and right of x at (width - x)
-        newArr = newArr[:, x - (width - x):2*(x - (width - x)) - 1]
-
-    return newArr
+    halfY = min(y, height - y - 1)
+    halfX = min(x, width - x - 1)
+    return array[y - halfY:y + halfY + 1, x - halfX:x + halfX + 1]
 
+# Adds errors in quadrature, ignoring NaNs; doesn't modify the input array
 def errorSum(array):
-    array *= array
-    sum = np.nansum(array)
-
-    return np.sqrt(sum)
+    return np.sqrt(np.nansum(np.square(array)))
 
 # Theta in degrees
 def mockGalaxy(xSD, ySD, theta, nx, ny):